@@ -1,8 +1,13 @@
 import typing
 
+import os
 import sys
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, islice
 from pathlib import Path
 
+import numpy as np
 from PyQt5 import uic
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
@@ -11,83 +16,67 @@ from evtx import PyEvtxParser
 from lxml import etree
 
 
-class XmlElement:
-    def __init__(self, root):
-        self.__children = dict()
-        for child in root:
-            # remove namespace
-            idx = child.tag.rfind('}')
-            self.__children[child.tag[idx+1:]] = XmlElement(child)
-        self.__node = root
-
-    @property
-    def text(self):
-        return self.__node.text
-
-    @property
-    def attrib(self):
-        return self.__node.attrib
-
-    def __getitem__(self, item):
-        return self.__children[item]
-
-class EventRecord:
-    def __init__(self, record):
-        self.__id = record['event_record_id']
-        self.__timestamp = record['timestamp']
-        self.__data = record['data']
-        self.__parsed = False
-        self.__attrib = dict()
-
-    @property
-    def id(self):
-        return self.__id
-
-    @property
-    def timestamp(self):
-        return self.__timestamp
-
-    @property
-    def data(self):
-        return self.__data
-
-    @property
-    def EventID(self):
-        self.__parse_data()
-        return self.__attrib["EventID"]
-
-    @property
-    def Provider(self):
-        self.__parse_data()
-        return self.__attrib["Provider"]
-
-    @property
-    def Level(self):
-        levels = {
-            0: "LogAlways",
-            1: "Critical",
-            2: "Error",
-            3: "Warning",
-            4: "Informational",
-            5: "Verbose"
-        }
-        self.__parse_data()
-        level_id = int(self.__attrib["Level"])
-        return levels[level_id]
-
-    def __parse_data(self):
-        if self.__parsed:
-            return
-        # remove processing instruction
-        idx = self.__data.find("?>")
-        if idx != -1:
-            self.__data = self.__data[idx+2:]
-        root = XmlElement(etree.XML(self.__data))
+# extract the System fields used by the table (provider, event id, level), compiled once
+_NS = {"e": "http://schemas.microsoft.com/win/2004/08/events/event"}
+_EVENT_TAG = "{%s}Event" % _NS["e"]
+_XP_FIELDS = (
+    etree.XPath("string(e:System/e:Provider/@Name)", namespaces=_NS),
+    etree.XPath("string(e:System/e:EventID)", namespaces=_NS),
+    etree.XPath("string(e:System/e:Level)", namespaces=_NS)
+)
+# fallback for events using another (or no) namespace
+_XP_SYSTEM = "*[local-name()='System']"
+_XP_FIELDS_ANY_NS = (
+    etree.XPath(f"string({_XP_SYSTEM}/*[local-name()='Provider']/@Name)"),
+    etree.XPath(f"string({_XP_SYSTEM}/*[local-name()='EventID'])"),
+    etree.XPath(f"string({_XP_SYSTEM}/*[local-name()='Level'])")
+)
+
+
+# standard level names, indexed by the numeric Level value
+_LEVELS = ("LogAlways", "Critical", "Error", "Warning", "Informational", "Verbose")
+
+# custom role returning the values of all roles the delegate paints, see EvtxItemDelegate
+MULTI_ROLE = Qt.UserRole + 1
 
-        self.__attrib["EventID"] = root["System"]["EventID"].text
-        self.__attrib["Level"] = root["System"]["Level"].text
-        self.__attrib["Provider"] = root["System"]["Provider"].attrib["Name"]
+# number of records parsed per fetchMore() call
+FETCH_BATCH_SIZE = 5000
 
+_SYSTEM_END = b"</System>"
+
+
+def _parse_system(data):
+    """Parses only the <System> header of an event, skipping the (often much larger) EventData."""
+    end = data.find(_SYSTEM_END)
+    if end != -1:
+        header = data[:end + len(_SYSTEM_END)] + b"</Event>"
+        try:
+            return etree.fromstring(header)
+        except etree.XMLSyntaxError:
+            pass  # unexpected layout, parse the whole event instead
+    return etree.fromstring(data)
+
+
+def _parse_one(record):
+    """Turns a raw PyEvtxParser record into a (id, timestamp, provider, event_id, level, data) tuple."""
+    data = record['data']
+    # the XML is kept as UTF-8 bytes, which lxml parses as is
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    root = _parse_system(data)
+    xp_provider, xp_event_id, xp_level = _XP_FIELDS if root.tag == _EVENT_TAG else _XP_FIELDS_ANY_NS
+    level = xp_level(root)
+    # keep provider-defined levels (and anything unparsable) as the raw value
+    if level.isdigit() and int(level) < len(_LEVELS):
+        level = _LEVELS[int(level)]
+    return (
+        record['event_record_id'],
+        record['timestamp'],
+        xp_provider(root),
+        xp_event_id(root),
+        level,
+        data
+    )
 
 
 class EvtxViewModel(QAbstractItemModel):
@@ -95,24 +84,39 @@ class EvtxViewModel(QAbstractItemModel):
         super(QAbstractItemModel, self).__init__()
         self.__filename = filename
         self.__chunks = 0
+        # one list per column, all indexed by row (sorted by record id)
+        self.__ids = list()
+        self.__timestamps = list()
+        self.__providers = list()
+        self.__event_ids = list()
+        self.__levels = list()
+        # the XML of all records, back to back in row order; row i ends at __data_ends[i]
+        self.__data_buf = bytearray()
+        self.__data_ends = list()
         self.__columns = [
-            ('ID', lambda r: r.id),
-            ('TimeCreated', lambda r: r.timestamp),
-            ('Provider', lambda r: r.Provider),
-            ('EventID', lambda r: r.EventID),
-            ('Level', lambda r: r.Level),
-            ('Data', lambda r: r.data)
+            ('ID', self.__ids),
+            ('TimeCreated', self.__timestamps),
+            ('Provider', self.__providers),
+            ('EventID', self.__event_ids),
+            ('Level', self.__levels),
+            ('Data', None)  # stored in __data_buf, see record_data()
         ]
+        self.__data_column = len(self.__columns) - 1
 
         #for idx in range(0, len(self.__columns)):
         #    self.setHeaderData(idx, Qt.Horizontal, self.__columns[0][0], Qt.DisplayRole)
 
-        self.__records = dict()
-        self.__record_ids = list()
-        self.load_data()
+        self.__id_to_row = dict()
+        # numpy copies of the short search columns, built on first search
+        self.__search_arrays = None
 
         self._highlighted_row = None
 
+        # records are parsed in batches as the view scrolls, see fetchMore()
+        self.__parser = PyEvtxParser(self.__filename)
+        self.__pending_records = self.__parser.records()
+        self.fetchMore(QModelIndex())
+
     def headerData(self, section, orientation, role=Qt.DisplayRole):
         if role == Qt.DisplayRole and orientation == Qt.Horizontal:
             return self.__columns[section][0]
@@ -120,14 +124,82 @@ class EvtxViewModel(QAbstractItemModel):
 
 
     def load_data(self):
-        self.__parser = PyEvtxParser(self.__filename)
-        for record in self.__parser.records():
-            self.__records[record["event_record_id"]] = EventRecord(record)
-            self.__record_ids.append(record["event_record_id"])
-        self.__record_ids.sort()
+        """Loads all records which have not been fetched yet."""
+        while self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return not parent.isValid() and self.__pending_records is not None
+
+    def fetchMore(self, parent: QModelIndex):
+        if parent.isValid() or self.__pending_records is None:
+            return
+
+        # drain the batch from the parser in one go before handing it to the workers
+        raw = list(islice(self.__pending_records, FETCH_BATCH_SIZE))
+        if len(raw) < FETCH_BATCH_SIZE:
+            self.__pending_records = None
+        if not raw:
+            return
+
+        # evtx logs are circular: once one has wrapped, newer chunks come before older ones
+        # in the file. Then the rest is loaded right away and all rows are sorted once.
+        wrapped = bool(self.__ids) and min(r['event_record_id'] for r in raw) < self.__ids[-1]
+        if wrapped and self.__pending_records is not None:
+            raw.extend(self.__pending_records)
+            self.__pending_records = None
+
+        # lxml releases the GIL while parsing, so the records can be parsed in parallel
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            columns = list(zip(*ex.map(_parse_one, raw)))
+        record_ids = columns[0]
+        if wrapped:
+            order = range(len(record_ids))  # __sort_rows() sorts all rows afterwards
+        else:
+            # every id in this batch is above the loaded ones, so sorting the batch keeps all rows sorted
+            order = sorted(range(len(record_ids)), key=record_ids.__getitem__)
+
+        first = len(self.__ids)
+        self.beginInsertRows(QModelIndex(), first, first + len(order) - 1)
+        # permute every column once, each list then grows by a single extend()
+        for (_, values), column in zip(self.__columns[:self.__data_column], columns):
+            values.extend([column[i] for i in order])
+        data = [columns[self.__data_column][i] for i in order]
+        self.__data_ends.extend(accumulate(map(len, data), initial=len(self.__data_buf)))
+        del self.__data_ends[first]  # the initial value is the end of the previous row
+        self.__data_buf += b"".join(data)
+        self.__id_to_row.update(zip(self.__ids[first:], range(first, len(self.__ids))))
+        self.__search_arrays = None
+        self.__chunks += 1
+        self.endInsertRows()
+
+        if wrapped:
+            self.__sort_rows()
+
+    def __sort_rows(self):
+        """Sorts all loaded rows by record id."""
+        self.layoutAboutToBeChanged.emit()
+        order = sorted(range(len(self.__ids)), key=self.__ids.__getitem__)
+        for _, values in self.__columns[:self.__data_column]:
+            values[:] = [values[i] for i in order]
+        data = [self.__data_buf[slice(*self.__data_range(i))] for i in order]
+        self.__data_buf = bytearray().join(data)
+        self.__data_ends[:] = accumulate(map(len, data))
+        self.__id_to_row = {record_id: row for row, record_id in enumerate(self.__ids)}
+        self.__search_arrays = None
+
+        new_rows = [0] * len(order)
+        for new_row, old_row in enumerate(order):
+            new_rows[old_row] = new_row
+        if self._highlighted_row is not None:
+            self._highlighted_row = new_rows[self._highlighted_row]
+        old_indexes = self.persistentIndexList()
+        self.changePersistentIndexList(
+            old_indexes, [self.index(new_rows[i.row()], i.column()) for i in old_indexes])
+        self.layoutChanged.emit()
 
     def rowCount(self, parent):
-        return len(self.__record_ids)
+        return len(self.__ids)
 
     def columnCount(self, parent):
         return len(self.__columns)
@@ -138,16 +210,13 @@ class EvtxViewModel(QAbstractItemModel):
     def set_highlighted_row(self, row):
         old_row = self._highlighted_row
         self._highlighted_row = row
-        # Emit dataChanged for old and new rows so the view updates
-        if old_row is not None:
-            topLeft_old = self.index(old_row, 0)
-            bottomRight_old = self.index(old_row, self.columnCount(None) - 1)
-            self.dataChanged.emit(topLeft_old, bottomRight_old, [Qt.BackgroundRole])
-
-        if row is not None:
-            topLeft_new = self.index(row, 0)
-            bottomRight_new = self.index(row, self.columnCount(None) - 1)
-            self.dataChanged.emit(topLeft_new, bottomRight_new, [Qt.BackgroundRole])
+        # Emit dataChanged for old and new rows so the view updates. A range makes
+        # QAbstractItemView repaint the whole viewport, so only the first cell is reported;
+        # the background is the same for the whole row and EvtxView repaints the rest of it.
+        for changed_row in (old_row, row):
+            if changed_row is not None:
+                cell = self.index(changed_row, 0)
+                self.dataChanged.emit(cell, cell, [Qt.BackgroundRole])
 
     def remove_highlight(self):
         self.set_highlighted_row(None)
@@ -156,29 +225,121 @@ class EvtxViewModel(QAbstractItemModel):
         if not index.isValid():
             return QVariant()
 
+        if role == MULTI_ROLE:
+            return {
+                Qt.DisplayRole: self.__display(index),
+                Qt.BackgroundRole: self.__background(index.row())
+            }
+
         if role == Qt.DisplayRole:
-            row = index.row()
-            record_id = self.__record_ids[row]
-            record = self.__records[record_id]
-            column = self.__columns[index.column()]
-            return column[1](record)
+            return self.__display(index)
 
         if role == Qt.BackgroundRole:
-            if index.row() == self._highlighted_row:
-                color = QColor("#FFFACD")
-                color.setAlpha(128)  # 0 = fully transparent, 255 = fully opaque
-                return QBrush(color)
+            background = self.__background(index.row())
+            if background is not None:
+                return background
 
         return QVariant()
 
+    def __display(self, index: QModelIndex):
+        column = index.column()
+        if column == self.__data_column:
+            return self.record_data(index.row())
+        return self.__columns[column][1][index.row()]
+
+    def __background(self, row):
+        if row == self._highlighted_row:
+            color = QColor("#FFFACD")
+            color.setAlpha(128)  # 0 = fully transparent, 255 = fully opaque
+            return QBrush(color)
+        return None
+
     def flags(self, index: QModelIndex) -> Qt.ItemFlags:
         return Qt.ItemIsEnabled | Qt.ItemNeverHasChildren
 
     def parent(self, qmodelindex=None):
         return QModelIndex()
     
-    def get_records(self):
-        return [self.__records[rid] for rid in self.__record_ids]
+    def __data_range(self, row):
+        return self.__data_ends[row - 1] if row else 0, self.__data_ends[row]
+
+    def record_data(self, row):
+        """Returns the event XML of the record in row."""
+        start, end = self.__data_range(row)
+        return self.__data_buf[start:end].decode("utf-8", "replace")
+
+    def record_at(self, row):
+        """Returns the (record id, event XML) of the record in row."""
+        return self.__ids[row], self.record_data(row)
+
+    def data_column(self):
+        """Returns the index of the 'Data' column."""
+        return self.__data_column
+
+    def row_for_id(self, record_id):
+        """Returns the row showing record_id, or None if there is no such record."""
+        return self.__id_to_row.get(record_id)
+
+    def search(self, text, search_data=False):
+        """Returns [record id, timestamp] pairs of all records whose Provider or EventID (or Data,
+        if search_data is set) contains text."""
+        # search covers the whole file, not only the rows fetched so far
+        self.load_data()
+        if self.__search_arrays is None:
+            self.__search_arrays = (np.array(self.__providers, dtype=str),
+                                    np.array(self.__event_ids, dtype=str))
+        providers, event_ids = self.__search_arrays
+        mask = (np.char.find(providers, text) >= 0) | (np.char.find(event_ids, text) >= 0)
+        if search_data:
+            # the XML is too long for a fixed width numpy string array; instead scan the
+            # shared buffer with bytearray.find and map each hit to its row
+            needle = text.encode("utf-8")
+            pos = self.__data_buf.find(needle)
+            while pos != -1:
+                row = bisect_right(self.__data_ends, pos)
+                end = self.__data_ends[row]
+                if pos + len(needle) <= end:
+                    mask[row] = True
+                    pos = end  # one hit per row is enough
+                else:
+                    pos += 1  # the match spans two records, it doesn't count
+                pos = self.__data_buf.find(needle, pos)
+        return [[self.__ids[row], self.__timestamps[row]] for row in np.flatnonzero(mask)]
+
+
+class EvtxItemDelegate(QStyledItemDelegate):
+    """Fetches all painted roles of a cell with a single MULTI_ROLE data() call and caches them,
+    so repaints don't go through data() once per role and cell."""
+    CACHE_SIZE = 4096
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__cache = dict()
+
+    def clear_cache(self, *args):
+        self.__cache.clear()
+
+    def invalidate_rows(self, top_left: QModelIndex, bottom_right: QModelIndex, *args):
+        rows = range(top_left.row(), bottom_right.row() + 1)
+        for key in [key for key in self.__cache if key[0] in rows]:
+            del self.__cache[key]
+
+    def initStyleOption(self, option: QStyleOptionViewItem, index: QModelIndex):
+        key = (index.row(), index.column())
+        roles = self.__cache.get(key)
+        if roles is None:
+            if len(self.__cache) >= self.CACHE_SIZE:
+                self.__cache.clear()
+            roles = self.__cache[key] = index.data(MULTI_ROLE)
+
+        option.index = index
+        text = roles[Qt.DisplayRole]
+        if text is not None:
+            option.features |= QStyleOptionViewItem.HasDisplay
+            option.text = self.displayText(text, option.locale)
+        background = roles[Qt.BackgroundRole]
+        if background is not None:
+            option.backgroundBrush = background
 
 
 class EvtxView(QTableView):
@@ -188,24 +349,38 @@ class EvtxView(QTableView):
         self.__evtxViewModel = EvtxViewModel(filename)
 
         self.setModel(self.__evtxViewModel)
+        self.__delegate = EvtxItemDelegate(self)
+        self.setItemDelegate(self.__delegate)
+        self.__evtxViewModel.dataChanged.connect(self.__delegate.invalidate_rows)
+        self.__evtxViewModel.modelReset.connect(self.__delegate.clear_cache)
+        self.__evtxViewModel.layoutChanged.connect(self.__delegate.clear_cache)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.verticalHeader().hide()
         self.setShowGrid(False)
 
         self._highlighted_row = None
 
+        # index of the 'Data' column, looked up once instead of on every double click
+        self._data_column_index = self.__evtxViewModel.data_column()
+
         # Connect the clicked signal to the handler method (opens then msg box woth the data)
         self.doubleClicked.connect(self.on_table_clicked)
 
     def get_evtxViewModel(self):
         return self.__evtxViewModel
+
+    def dataChanged(self, topLeft: QModelIndex, bottomRight: QModelIndex, roles: typing.Iterable[int] = ()):
+        super().dataChanged(topLeft, bottomRight, roles)
+        if Qt.BackgroundRole in roles:
+            # highlight changes are reported for the first cell only, repaint the whole row
+            rect = self.visualRect(topLeft)
+            self.viewport().update(0, rect.y(), self.viewport().width(), rect.height())
     
 
     def scroll_to_record_id(self, record_id):
         model = self.get_evtxViewModel()
-        try:
-            row = model._EvtxViewModel__record_ids.index(record_id)
-        except ValueError:
+        row = model.row_for_id(record_id)
+        if row is None:
             print(f"Record ID {record_id} not found")
             return
 
@@ -220,20 +395,21 @@ class EvtxView(QTableView):
 
     def on_table_clicked(self, index: QModelIndex):
         # Check if the clicked column is the 'Data' column
-        # Assuming 'Data' is last column (or find its index dynamically)
-        data_column_index = None
-        for i, (name, _) in enumerate(self.__evtxViewModel._EvtxViewModel__columns):
-            if name == "Data":
-                data_column_index = i
-                break
-
-        if index.column() == data_column_index:
+        if index.column() == self._data_column_index:
             row = index.row()
-            record_id = self.__evtxViewModel._EvtxViewModel__record_ids[row]
-            record = self.__evtxViewModel._EvtxViewModel__records[record_id]
+            record_id, data = self.__evtxViewModel.record_at(row)
             # Now do something with the 'Data' cell clicked:
-            print(f"Data cell clicked at row {row}: {record.data}")
-            QMessageBox.information(self, f"Event Data for Event with Record id: {record_id}", record.data)
+            print(f"Data cell clicked at row {row}: {data}")
+            # QPlainTextEdit lays out text per block, so large events don't freeze the UI like a QMessageBox
+            dialog = QDialog(self)
+            dialog.setWindowTitle(f"Event Data for Event with Record id: {record_id}")
+            text_edit = QPlainTextEdit(data, dialog)
+            text_edit.setReadOnly(True)
+            text_edit.setLineWrapMode(QPlainTextEdit.NoWrap)
+            QVBoxLayout(dialog).addWidget(text_edit)
+            dialog.resize(800, 600)
+            dialog.setAttribute(Qt.WA_DeleteOnClose)
+            dialog.show()  # Non-modal, main window stays usable
 
 
 
@@ -291,11 +467,13 @@ class MainWindow(QMainWindow):
 
     def close_tab(self, index):
         self.__tab_widget.removeTab(index)
-        tmp = dict()
+        filename = next((f for f, idx in self.__files.items() if idx == index), None)
+        if filename is not None:
+            del self.__files[filename]
+        # tabs to the right of the closed one moved one position to the left
         for filename, idx in self.__files.items():
-            if idx != index:
-                tmp[filename] = self.__files[filename]
-        self.__files = tmp
+            if idx > index:
+                self.__files[filename] = idx - 1
 
     def action_exit(self):
         self.close()
@@ -327,13 +505,7 @@ class MainWindow(QMainWindow):
             model : EvtxViewModel = evtx_view.get_evtxViewModel()
 
             ## search
-            found = []
-            for record in model.get_records():
-                record : EventRecord
-                # (text in record.data)
-                if (text in record.Provider) or (text in record.EventID) or (self.searchInEVTData.isChecked() and (text in record.data)):
-                    #found.append(f"Record ID: {record.id} Time: {record.timestamp}")
-                    found.append([record.id, record.timestamp])
+            found = model.search(text, self.searchInEVTData.isChecked())
 
             if found:
                 self.found = found